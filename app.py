@@ -1,8 +1,11 @@
 import streamlit as st
 import requests
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
-from datetime import datetime
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # --- Configuration ---
 st.set_page_config(
@@ -15,6 +18,8 @@ st.set_page_config(
 # --- Constants ---
 BASE_URL = "https://api-web.nhle.com/v1"
 SEARCH_URL = "https://search.d3.nhle.com/api/v1/search/player"
+SEARCH_LIMIT = 15
+HTTP_TIMEOUT = 5
 
 # Final Metric List
 METRIC_OPTIONS = {
@@ -45,6 +50,21 @@ METRIC_OPTIONS = {
     }
 }
 
+# Per-game stat value for each line-chart metric
+METRIC_VALUES = {
+    'points': lambda df: df['points'],
+    'goals': lambda df: df['goals'],
+    'assists': lambda df: df['assists'],
+    'plusMinus': lambda df: df['plusMinus'],
+    'shots': lambda df: df['shots'],
+    'toi': lambda df: df['toi_val'],
+    'esToi': lambda df: (df['toi_val'] - df['pp_toi_val'] - df['sh_toi_val']).clip(lower=0),
+    'evenStrengthPoints': lambda df: df['points'] - df['powerPlayPoints'] - df['shorthandedPoints']
+}
+
+# Integer per-game counts from the game log, stored as int32
+REQUIRED_INT_COLS = ['goals', 'assists', 'points', 'shots', 'plusMinus', 'powerPlayPoints', 'shorthandedPoints', 'powerPlayGoals', 'shorthandedGoals']
+
 COLORS = [
     '#38bdf8', # Blue
     '#f472b6', # Pink
@@ -53,15 +73,21 @@ COLORS = [
 
 # --- Helper Functions ---
 
-def parse_toi(toi_str):
-    if not toi_str:
-        return 0.0
-    try:
-        mm, ss = map(int, toi_str.split(':'))
-        return mm + (ss / 60.0)
-    except:
-        return 0.0
-
+@st.cache_resource(show_spinner=False)
+def _http():
+    # One session per server process so repeat calls reuse the TCP/TLS connection
+    s = requests.Session()
+    s.headers.update({'Accept': 'application/json'})
+    return s
+
+def parse_toi_series(toi):
+    # "MM:SS" strings -> minutes; missing or malformed values become 0.0
+    parts = toi.fillna('').astype(str).str.split(':', n=1, expand=True).reindex(columns=[0, 1])
+    mm = pd.to_numeric(parts[0], errors='coerce')
+    ss = pd.to_numeric(parts[1], errors='coerce')
+    return (mm + ss / 60.0).fillna(0.0)
+
+@lru_cache(maxsize=64)
 def format_season(season_id):
     s = str(season_id)
     return f"{s[2:4]}-{s[6:8]}"
@@ -71,8 +97,9 @@ def search_player(query):
     if len(query) < 3:
         return []
     try:
-        url = f"{SEARCH_URL}?culture=en-us&limit=15&q={query}"
-        resp = requests.get(url)
+        url = f"{SEARCH_URL}?culture=en-us&limit={SEARCH_LIMIT}&q={query}"
+        resp = _http().get(url, timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
         data = resp.json()
         return data[:10]
     except Exception as e:
@@ -82,23 +109,68 @@ def search_player(query):
 def get_player_details(player_id):
     try:
         url = f"{BASE_URL}/player/{player_id}/landing"
-        resp = requests.get(url)
+        resp = _http().get(url, timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
         return resp.json()
     except:
         return None
 
-@st.cache_data(ttl=600)
+@st.cache_data(ttl=600, show_spinner=False)
 def get_game_log(player_id, season):
     try:
         url = f"{BASE_URL}/player/{player_id}/game-log/{season}/2"
-        resp = requests.get(url)
+        resp = _http().get(url, timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
         return resp.json()
     except:
         return None
 
+@st.cache_data(ttl=600, show_spinner=False)
+def build_base_df(player_id, season):
+    # Sorted game log with stat columns guaranteed; all distribution mode needs
+    log = get_game_log(player_id, season)
+    if not log or 'gameLog' not in log:
+        return None
+
+    df = pd.DataFrame(log['gameLog'])
+    df['date_obj'] = pd.to_datetime(df['gameDate'])
+    df = df.sort_values('date_obj').reset_index(drop=True)
+    df['game_number'] = df.index + 1
+
+    missing = [c for c in REQUIRED_INT_COLS if c not in df.columns]
+    if missing:
+        df[missing] = 0
+    df[REQUIRED_INT_COLS] = df[REQUIRED_INT_COLS].fillna(0).astype('int32')
+    return df
+
+@st.cache_data(ttl=600, show_spinner=False)
+def build_line_cols(player_id, season):
+    # Only the metric-independent TOI and cumulative columns the line charts add to the base frame
+    df = build_base_df(player_id, season)
+    if df is None:
+        return None
+
+    cols = pd.DataFrame(index=df.index)
+    cols['toi_val'] = parse_toi_series(df['toi']).astype('float32')
+    cols['pp_toi_val'] = parse_toi_series(df.get('powerPlayToi', pd.Series('00:00', index=df.index))).astype('float32')
+    cols['sh_toi_val'] = parse_toi_series(df.get('shorthandedToi', pd.Series('00:00', index=df.index))).astype('float32')
+
+    cols['pp_sh_pts'] = df['powerPlayPoints'] + df['shorthandedPoints']
+    cum = pd.concat([df[['goals', 'shots', 'points']], cols['pp_sh_pts']], axis=1).cumsum()
+    cols[['cum_goals', 'cum_shots', 'cum_points', 'cum_pp_sh_pts']] = cum.values
+    return cols
+
+def load_player_df(player_id, season, with_line_cols):
+    df = build_base_df(player_id, season)
+    if df is None or not with_line_cols:
+        return df
+    return df.join(build_line_cols(player_id, season))
+
 # --- Session State ---
 if 'players' not in st.session_state:
     st.session_state.players = [] 
+if 'search_query' not in st.session_state:
+    st.session_state.search_query = ''
 
 def add_player(player_data):
     if len(st.session_state.players) >= 3:
@@ -131,7 +203,8 @@ def add_player(player_data):
         'selected_season': seasons[0],
         'available_seasons': seasons,
         'color_idx': len(st.session_state.players),
-        'instance_id': datetime.now().timestamp()
+        # Captured once at add-time so the player's widget keys stay stable across reruns
+        'instance_id': uuid.uuid4().hex
     })
 
 def remove_player(idx):
@@ -147,15 +220,22 @@ st.caption("A Xenos app based on live NHL API data")
 # 1. Sidebar / Top Controls
 with st.expander("Player Selection", expanded=True if not st.session_state.players else False):
     
-    c1, c2 = st.columns([3, 1])
-    with c1:
-        search_q = st.text_input("Search Player (e.g. MacKinnon)", key="search_box")
-    with c2:
-        st.write("") 
-        st.write("") 
-        
-    if len(search_q) >= 3:
-        results = search_player(search_q)
+    # Form defers the rerun (and the API call) until the user submits
+    with st.form("search_form", clear_on_submit=False):
+        c1, c2 = st.columns([3, 1])
+        with c1:
+            search_q = st.text_input("Search Player (e.g. MacKinnon)", key="search_box")
+        with c2:
+            st.write("") 
+            st.write("") 
+            submitted = st.form_submit_button("Search", use_container_width=True)
+
+    # Keep the last submitted query so results (and their Add buttons) survive later reruns
+    if submitted:
+        st.session_state.search_query = search_q
+
+    if len(st.session_state.search_query) >= 3:
+        results = search_player(st.session_state.search_query)
         if results:
             st.markdown("### Results")
             for p in results:
@@ -163,7 +243,7 @@ with st.expander("Player Selection", expanded=True if not st.session_state.playe
                 with col_res:
                     st.write(f"**{p['name']}** ({p['teamAbbrev']})")
                 with col_btn:
-                    # FIX: Removed datetime.now() from key to ensure stability
+                    # Keyed on player id only so the widget identity survives reruns
                     if st.button("Add", key=f"add_{p['playerId']}"):
                         add_player(p)
                         st.rerun()
@@ -233,147 +313,79 @@ if st.session_state.players:
             all_dfs = []
             distribution_summaries = []
             
-            for i, p in enumerate(st.session_state.players):
-                log = get_game_log(p['id'], p['selected_season'])
-                
-                if log and 'gameLog' in log:
-                    df = pd.DataFrame(log['gameLog'])
-                    df['date_obj'] = pd.to_datetime(df['gameDate'])
-                    df = df.sort_values('date_obj').reset_index(drop=True)
-                    df['game_number'] = df.index + 1
-                    
-                    df['toi_val'] = df['toi'].apply(parse_toi)
-                    df['pp_toi_val'] = df.get('powerPlayToi', pd.Series(['00:00']*len(df))).apply(parse_toi)
-                    df['sh_toi_val'] = df.get('shorthandedToi', pd.Series(['00:00']*len(df))).apply(parse_toi)
-                    
-                    for col in ['goals', 'assists', 'points', 'shots', 'plusMinus', 'powerPlayPoints', 'shorthandedPoints', 'powerPlayGoals', 'shorthandedGoals']:
-                        if col not in df.columns:
-                            df[col] = 0
-
+            players = st.session_state.players
+            # Each player is an independent fetch + parse, build them concurrently.
+            # Worker threads have no ScriptRunContext, so the cached functions they call
+            # use show_spinner=False; the st.spinner above covers the whole block instead.
+            with ThreadPoolExecutor(max_workers=3) as ex:
+                with_line_cols = mode_key != 'distribution'
+                base_dfs = list(ex.map(lambda p: load_player_df(p['id'], p['selected_season'], with_line_cols), players))
+            
+            for i, (p, df) in enumerate(zip(players, base_dfs)):
+                if df is not None:
                     if mode_key == 'distribution':
-                        totals = {
-                            'goals': df['goals'].sum(),
-                            'assists': df['assists'].sum(),
-                            'points': df['points'].sum(),
-                            'pp_goals': df['powerPlayGoals'].sum(),
-                            'sh_goals': df['shorthandedGoals'].sum(),
-                            'pp_points': df['powerPlayPoints'].sum(),
-                            'sh_points': df['shorthandedPoints'].sum(),
-                            'es_goals': df['goals'].sum() - df['powerPlayGoals'].sum() - df['shorthandedGoals'].sum(),
-                            'es_points': df['points'].sum() - df['powerPlayPoints'].sum() - df['shorthandedPoints'].sum(),
-                            'pp_assists': (df['powerPlayPoints'].sum() - df['powerPlayGoals'].sum()),
-                            'sh_assists': (df['shorthandedPoints'].sum() - df['shorthandedGoals'].sum()),
-                        }
-                        totals['es_assists'] = df['assists'].sum() - totals['pp_assists'] - totals['sh_assists']
+                        tot = df[['goals', 'assists', 'points', 'powerPlayGoals', 'shorthandedGoals', 'powerPlayPoints', 'shorthandedPoints']].sum()
+                        pp_assists = tot['powerPlayPoints'] - tot['powerPlayGoals']
+                        sh_assists = tot['shorthandedPoints'] - tot['shorthandedGoals']
                         
                         dist_data = {'name': p['name'], 'season': format_season(p['selected_season']), 'color': COLORS[i]}
                         
                         if selected_metric_id == 'pointsComp':
                             dist_data['labels'] = ['Goals', 'Assists']
-                            dist_data['values'] = [totals['goals'], totals['assists']]
+                            dist_data['values'] = [tot['goals'], tot['assists']]
                         elif selected_metric_id == 'pointsSit':
                             dist_data['labels'] = ['Even Strength', 'Power Play', 'Shorthanded']
-                            dist_data['values'] = [totals['es_points'], totals['pp_points'], totals['sh_points']]
+                            dist_data['values'] = [tot['points'] - tot['powerPlayPoints'] - tot['shorthandedPoints'], tot['powerPlayPoints'], tot['shorthandedPoints']]
                         elif selected_metric_id == 'goalsSit':
                             dist_data['labels'] = ['Even Strength', 'Power Play', 'Shorthanded']
-                            dist_data['values'] = [totals['es_goals'], totals['pp_goals'], totals['sh_goals']]
+                            dist_data['values'] = [tot['goals'] - tot['powerPlayGoals'] - tot['shorthandedGoals'], tot['powerPlayGoals'], tot['shorthandedGoals']]
                         elif selected_metric_id == 'assistsSit':
                             dist_data['labels'] = ['Even Strength', 'Power Play', 'Shorthanded']
-                            dist_data['values'] = [totals['es_assists'], totals['pp_assists'], totals['sh_assists']]
+                            dist_data['values'] = [tot['assists'] - pp_assists - sh_assists, pp_assists, sh_assists]
                             
                         distribution_summaries.append(dist_data)
 
                     else:
-                        vals = []
+                        # Rate metrics (shootingPct, evenStrengthPct) are derived from the cumulative columns below
+                        stat_fn = METRIC_VALUES.get(selected_metric_id)
+                        df['stat_val'] = stat_fn(df) if stat_fn else 0
                         
-                        for _, row in df.iterrows():
-                            val = 0
-                            if selected_metric_id == 'points': val = row['points']
-                            elif selected_metric_id == 'goals': val = row['goals']
-                            elif selected_metric_id == 'assists': val = row['assists']
-                            elif selected_metric_id == 'plusMinus': val = row['plusMinus']
-                            elif selected_metric_id == 'shots': val = row['shots']
-                            elif selected_metric_id == 'toi': val = row['toi_val']
-                            elif selected_metric_id == 'esToi': val = max(0, row['toi_val'] - row['pp_toi_val'] - row['sh_toi_val'])
-                            elif selected_metric_id == 'evenStrengthPoints': val = row['points'] - (row['powerPlayPoints'] + row['shorthandedPoints'])
-                            
-                            vals.append(val)
+                        df['cum_val'] = df['stat_val'].cumsum()
                         
-                        df['stat_val'] = vals
+                        gp = np.arange(1, len(df) + 1, dtype=np.float32)
                         
-                        df['cum_val'] = df['stat_val'].cumsum()
-                        df['cum_goals'] = df['goals'].cumsum()
-                        df['cum_shots'] = df['shots'].cumsum()
-                        df['cum_points'] = df['points'].cumsum()
-                        df['cum_pp_sh_pts'] = (df['powerPlayPoints'] + df['shorthandedPoints']).cumsum()
+                        if selected_metric_id == 'shootingPct':
+                            res = np.where(df['cum_shots'] > 0, df['cum_goals'] / df['cum_shots'] * 100, 0)
+                        elif selected_metric_id == 'evenStrengthPct':
+                            res = np.where(df['cum_points'] > 0, (df['cum_points'] - df['cum_pp_sh_pts']) / df['cum_points'] * 100, 0)
+                        elif selected_metric_id in ['toi', 'esToi'] or (selected_metric_id == 'shots' and mode_key == 'projection'):
+                            res = df['cum_val'] / gp
+                        elif mode_key == 'projection':
+                            # Counting stats paced out to a full 82-game season
+                            res = df['cum_val'] * (82.0 / gp)
+                        else:
+                            res = df['cum_val']
                         
-                        y_values = []
+                        df['y_final'] = res
                         
-                        for idx, row in df.iterrows():
-                            gp = row['game_number']
-                            res = 0
+                        if mode_key == 'projection':
+                            roll = df[['stat_val', 'goals', 'shots', 'points', 'pp_sh_pts']].rolling(10).sum()
                             
                             if selected_metric_id == 'shootingPct':
-                                res = (row['cum_goals'] / row['cum_shots'] * 100) if row['cum_shots'] > 0 else 0
+                                r_res = np.where(roll['shots'] > 0, roll['goals'] / roll['shots'] * 100, 0)
                             elif selected_metric_id == 'evenStrengthPct':
-                                res = ((row['cum_points'] - row['cum_pp_sh_pts']) / row['cum_points'] * 100) if row['cum_points'] > 0 else 0
-                            elif selected_metric_id in ['toi', 'esToi']:
-                                res = row['cum_val'] / gp 
-                            elif selected_metric_id == 'shots' and mode_key == 'projection':
-                                res = row['cum_val'] / gp 
+                                r_res = np.where(roll['points'] > 0, (roll['points'] - roll['pp_sh_pts']) / roll['points'] * 100, 0)
+                            elif selected_metric_id in ['toi', 'esToi', 'shots']:
+                                r_res = roll['stat_val'] / 10
                             else:
-                                res = row['cum_val'] 
-                            
-                            final_val = res
-                            if mode_key == 'projection':
-                                is_rate = selected_metric_id in ['shootingPct', 'evenStrengthPct', 'toi', 'esToi', 'shots']
-                                if not is_rate:
-                                    final_val = (res / gp) * 82
+                                r_res = roll['stat_val'] * (82 / 10)
                             
-                            y_values.append(final_val)
+                            y_rolling = pd.Series(r_res, index=df.index, dtype=float)
+                            y_rolling.iloc[:9] = np.nan
+                            df['y_rolling'] = y_rolling
 
-                        df['y_final'] = y_values
-                        df['player_name'] = p['name']
-                        df['color'] = COLORS[i]
-                        df['season_label'] = format_season(p['selected_season'])
-                        
-                        if mode_key == 'projection':
-                            roll_y = []
-                            for idx in range(len(df)):
-                                if idx < 9:
-                                    roll_y.append(None)
-                                    continue
-                                
-                                slice_df = df.iloc[idx-9 : idx+1]
-                                
-                                s_val = slice_df['stat_val'].sum()
-                                s_goals = slice_df['goals'].sum()
-                                s_shots = slice_df['shots'].sum()
-                                s_pts = slice_df['points'].sum()
-                                s_spec = slice_df['powerPlayPoints'].sum() + slice_df['shorthandedPoints'].sum()
-                                
-                                r_res = 0
-                                if selected_metric_id == 'shootingPct':
-                                    r_res = (s_goals / s_shots * 100) if s_shots > 0 else 0
-                                elif selected_metric_id == 'evenStrengthPct':
-                                    r_res = ((s_pts - s_spec) / s_pts * 100) if s_pts > 0 else 0
-                                elif selected_metric_id in ['toi', 'esToi']:
-                                    r_res = s_val / 10
-                                elif selected_metric_id == 'shots':
-                                    r_res = s_val / 10 
-                                else:
-                                    r_res = s_val 
-                                
-                                r_final = r_res
-                                is_rate = selected_metric_id in ['shootingPct', 'evenStrengthPct', 'toi', 'esToi', 'shots']
-                                if not is_rate:
-                                    r_final = (r_res / 10) * 82
-                                
-                                roll_y.append(r_final)
-                            
-                            df['y_rolling'] = roll_y
-
-                        all_dfs.append(df)
+                        player_meta = {'name': p['name'], 'color': COLORS[i], 'season_label': format_season(p['selected_season'])}
+                        all_dfs.append((df, player_meta))
 
             if mode_key == 'distribution':
                 cols = st.columns(len(distribution_summaries))
@@ -411,13 +423,13 @@ if st.session_state.players:
                 else:
                     fig = go.Figure()
                     
-                    for i, df in enumerate(all_dfs):
+                    for df, meta in all_dfs:
                         fig.add_trace(go.Scatter(
                             x=df['game_number'],
                             y=df['y_final'],
                             mode='lines',
-                            name=f"{df['player_name'][0]} ({df['season_label'][0]})",
-                            line=dict(color=df['color'][0], width=3)
+                            name=f"{meta['name']} ({meta['season_label']})",
+                            line=dict(color=meta['color'], width=3)
                         ))
                         
                         if mode_key == 'projection':
@@ -425,8 +437,8 @@ if st.session_state.players:
                                 x=df['game_number'],
                                 y=df['y_rolling'],
                                 mode='lines',
-                                name=f"{df['player_name'][0]} (Rolling)",
-                                line=dict(color=df['color'][0], width=1, dash='dash'),
+                                name=f"{meta['name']} (Rolling)",
+                                line=dict(color=meta['color'], width=1, dash='dash'),
                                 opacity=0.7
                             ))
 
@@ -449,9 +461,12 @@ if st.session_state.players:
                     st.plotly_chart(fig, use_container_width=True)
                     
                     with st.expander("View Raw Data"):
-                        cols_to_show = ['player_name', 'game_number', 'y_final']
+                        cols_to_show = ['game_number', 'y_final']
                         if mode_key == 'projection': cols_to_show.append('y_rolling')
-                        combined = pd.concat(all_dfs)[cols_to_show]
+                        combined = pd.concat(
+                            [df[cols_to_show].assign(player_name=meta['name'])[['player_name'] + cols_to_show] for df, meta in all_dfs],
+                            ignore_index=True
+                        )
                         st.dataframe(combined, use_container_width=True)
 
 else: